@@ -8,7 +8,6 @@
 
 import numpy as np
 
-from copy import deepcopy
 import logging
 
 from ._history import History
@@ -118,27 +117,35 @@ class UpdateInfo(Bunch):
 # ClusterMetadataUpdater class
 #------------------------------------------------------------------------------
 
+# Marker for a cluster field without a value.
+_NOT_SET = object()
+
+
 class ClusterMeta(object):
     """Handle cluster metadata changes."""
     def __init__(self):
         self._fields = {}
+        # Sorted tuple of the field names, recomputed when a field is added.
+        self._sorted_fields = ()
+        # Incremented at every change of the metadata.
+        self.version = 0
         self._reset_data()
 
     def _reset_data(self):
         self._data = {}
-        self._data_base = {}
-        # The stack contains (clusters, field, value, update_info, undo_state)
-        # tuples.
-        self._undo_stack = History((None, None, None, None, None))
+        # The stack contains (clusters, field, value, update_info, undo_state, old_values)
+        # tuples, where old_values is a dict {cluster: previous_value} used to undo the change.
+        self._undo_stack = History((None, None, None, None, None, None))
 
     @property
     def fields(self):
-        """List of fields."""
-        return sorted(self._fields.keys())
+        """Sorted tuple of fields."""
+        return self._sorted_fields
 
     def add_field(self, name, default_value=None):
         """Add a field with an optional default value."""
         self._fields[name] = default_value
+        self._sorted_fields = tuple(sorted(self._fields))
 
         def func(cluster):
             return self.get(name, cluster)
@@ -153,12 +160,12 @@ class ClusterMeta(object):
             for cluster, vals in dic.items():
                 for field, value in vals.items():
                     self.set(field, [cluster], value, add_to_stack=False)
-        self._data_base = deepcopy(self._data)
 
     def to_dict(self, field):
         """Export data to a `{cluster_id: value}` dictionary, for a particular field."""
         assert field in self._fields, "This field doesn't exist"
-        return {cluster: self.get(field, cluster) for cluster in self._data.keys()}
+        default = self._fields[field]
+        return {cluster: values.get(field, default) for cluster, values in self._data.items()}
 
     def set(self, field, clusters, value, add_to_stack=True):
         """Set the value of one of several clusters.
@@ -187,9 +194,15 @@ class ClusterMeta(object):
         assert field in self._fields
 
         clusters = _as_list(clusters)
+        self.version += 1
+        # Keep the previous values, only needed to undo the change.
+        old_values = {}
         for cluster in clusters:
             if cluster not in self._data:
                 self._data[cluster] = {}
+            if add_to_stack:
+                # NOTE: a cluster may appear several times, keep its value before the change.
+                old_values.setdefault(cluster, self._data[cluster].get(field, _NOT_SET))
             self._data[cluster][field] = value
 
         up = UpdateInfo(description='metadata_' + field,
@@ -199,7 +212,7 @@ class ClusterMeta(object):
         undo_state = emit('request_undo_state', self, up)
 
         if add_to_stack:
-            self._undo_stack.add((clusters, field, value, up, undo_state))
+            self._undo_stack.add((clusters, field, value, up, undo_state, old_values))
             emit('cluster', self, up)
 
         return up
@@ -266,13 +279,18 @@ class ClusterMeta(object):
         args = self._undo_stack.back()
         if args is None:
             return
-        self._data = deepcopy(self._data_base)
-        for clusters, field, value, up, undo_state in self._undo_stack:
-            if clusters is not None:
-                self.set(field, clusters, value, add_to_stack=False)
+        clusters, field, value, up, undo_state, old_values = args
+        self.version += 1
+        # Restore the previous values of the changed clusters.
+        for cluster, old_value in old_values.items():
+            if old_value is _NOT_SET:
+                self._data[cluster].pop(field, None)
+                if not self._data[cluster]:
+                    del self._data[cluster]
+            else:
+                self._data[cluster][field] = old_value
 
         # Return the UpdateInfo instance of the undo action.
-        up, undo_state = args[-2:]
         up.history = 'undo'
         up.undo_state = undo_state
 
@@ -291,7 +309,7 @@ class ClusterMeta(object):
         args = self._undo_stack.forward()
         if args is None:
             return
-        clusters, field, value, up, undo_state = args
+        clusters, field, value, up, undo_state, old_values = args
         self.set(field, clusters, value, add_to_stack=False)
 
         # Return the UpdateInfo instance of the redo action.
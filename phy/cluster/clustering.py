@@ -232,7 +232,9 @@ class Clustering(object):
                 self._spikes_per_cluster[clu] = spk
         # If spikes_per_cluster is invalid, recompute the entire
         # spikes_per_cluster array.
-        coherent = np.all(np.in1d(self._cluster_ids, sorted(self._spikes_per_cluster)))
+        spc = self._spikes_per_cluster
+        clusters = np.fromiter(spc.keys(), dtype=np.int64, count=len(spc))
+        coherent = np.all(np.in1d(self._cluster_ids, clusters))
         if not coherent:
             logger.debug("Recompute spikes_per_cluster manually: this might take a while.")
             sc = self._spike_clusters
@@ -7,9 +7,12 @@
 # Imports
 # -----------------------------------------------------------------------------
 
-from functools import partial
+from collections import deque
+from functools import partial, lru_cache
 import inspect
+from itertools import chain
 import logging
+from timeit import default_timer
 
 import numpy as np
 
@@ -19,7 +22,9 @@ from .clustering import Clustering
 
 from phylib.utils import Bunch, emit, connect, unconnect
 from phy.gui.actions import Actions
-from phy.gui.qt import _block, set_busy, _wait
+from phy.gui.qt import (
+    _block, set_busy, _wait, _DEFAULT_TIMEOUT, AsyncCaller, QApplication, QEventLoop,
+    QThreadPool, QTimer, Worker)
 from phy.gui.widgets import Table, HTMLWidget, _uniq, Barrier
 
 logger = logging.getLogger(__name__)
@@ -46,10 +51,51 @@ def _process_ups(ups):  # pragma: no cover
 
 
 def _ensure_all_ints(l):
-    if (l is None or l == []):
-        return
-    for i in range(len(l)):
-        l[i] = int(l[i])
+    """Return a list of Python ints, with a single NumPy cast instead of a Python loop."""
+    if l is None:
+        return []
+    if not (isinstance(l, np.ndarray) and np.issubdtype(l.dtype, np.integer)):
+        l = np.asarray(l, dtype=np.int64)
+    return l.tolist()
+
+
+def _concatenate_spike_ids(arrays):
+    """Concatenate arrays of spike ids into a single int64 array, with one allocation."""
+    arrays = [a for a in arrays if a is not None]
+    out = np.empty(sum(len(a) for a in arrays), dtype=np.int64)
+    offset = 0
+    for a in arrays:
+        out[offset:offset + len(a)] = a
+        offset += len(a)
+    return out
+
+
+def _equal(a, b):
+    """Compare two objects, which may contain NumPy arrays."""
+    try:
+        return bool(a == b)
+    except ValueError:  # the truth value of an array is ambiguous
+        return False
+
+
+def _has_callback_arg(f):
+    """Return whether a function accepts a `callback` keyword argument."""
+    argspec = inspect.getfullargspec(f)
+    return 'callback' in argspec.args + argspec.kwonlyargs
+
+
+@lru_cache(maxsize=None)
+def _method_accepts_callback(cls, name):
+    return _has_callback_arg(getattr(cls, name))
+
+
+def _accepts_callback(obj, name):
+    """Return whether the method `name` of an object accepts a `callback` keyword argument."""
+    # The result is only cached for the methods defined on the class, not for the instance
+    # attributes or the attributes obtained through __getattr__().
+    if name not in getattr(obj, '__dict__', ()) and hasattr(type(obj), name):
+        return _method_accepts_callback(type(obj), name)
+    return _has_callback_arg(getattr(obj, name))
 
 
 # -----------------------------------------------------------------------------
@@ -68,21 +114,43 @@ class TaskLogger(object):
         self.similarity_view = similarity_view
         self.supervisor = supervisor
         self._processing = False
+        # Whether process() is draining the queue, and whether a task has completed during
+        # the drain so that the next task can be processed in the same loop.
+        self._draining = False
+        self._resume = False
         # List of tasks that have completed.
-        self._history = []
+        self._history = deque()
+        # Name, number of arguments and keyword arguments of the last task in the history.
+        self._last_key = None
+        # Outputs of the last cluster view and similarity view selections, so that the current
+        # state does not require a scan of the history.
+        self._last_cluster_select = None
+        self._last_similarity_select = (None, None)
+        # Incremented every time the selection state changes.
+        self.state_version = 0
+        # States to select after an undo or a redo, pushed when a clustering action or an undo
+        # is performed.
+        self._undo_stack = deque()
+        self._redo_stack = deque()
         # Tasks that have yet to be performed.
-        self._queue = []
+        self._queue = deque()
+        # Task being performed, that will complete with the next supervisor cluster event.
+        self._pending_task = None
+        if supervisor is not None:
+            connect(self._on_cluster, event='cluster', sender=supervisor)
 
     def enqueue(self, sender, name, *args, output=None, **kwargs):
         """Enqueue an action, which has a sender, a function name, a list of arguments,
         and an optional output."""
-        logger.log(
-            5, "Enqueue %s %s %s %s (%s)", sender.__class__.__name__, name, args, kwargs, output)
+        if logger.isEnabledFor(5):
+            logger.log(
+                5, "Enqueue %s %s %s %s (%s)",
+                sender.__class__.__name__, name, args, kwargs, output)
         self._queue.append((sender, name, args, kwargs))
 
     def dequeue(self):
         """Dequeue the oldest item in the queue."""
-        return self._queue.pop(0) if self._queue else None
+        return self._queue.popleft() if self._queue else None
 
     def _callback(self, task, output):
         """Called after the execution of an action in the queue.
@@ -101,30 +169,54 @@ class TaskLogger(object):
     def _eval(self, task):
         """Evaluate a task and call a callback function."""
         sender, name, args, kwargs = task
-        logger.log(5, "Calling %s.%s(%s)", sender.__class__.__name__, name, args, kwargs)
+        if logger.isEnabledFor(5):
+            logger.log(5, "Calling %s.%s(%s, %s)", sender.__class__.__name__, name, args, kwargs)
         f = getattr(sender, name)
         callback = partial(self._callback, task)
-        argspec = inspect.getfullargspec(f)
-        argspec = argspec.args + argspec.kwonlyargs
-        if 'callback' in argspec:
+        if _accepts_callback(sender, name):
             f(*args, **kwargs, callback=callback)
         else:
             # HACK: use on_cluster event instead of callback.
-            def _cluster_callback(tsender, up):
-                self._callback(task, up)
-            connect(_cluster_callback, event='cluster', sender=self.supervisor)
-            f(*args, **kwargs)
-            unconnect(_cluster_callback)
+            self._pending_task = task
+            try:
+                f(*args, **kwargs)
+            finally:
+                self._pending_task = None
+
+    def _on_cluster(self, sender, up):
+        """Complete the pending task after the cluster event it has raised."""
+        task = self._pending_task
+        if task is None:
+            return
+        self._pending_task = None
+        self._callback(task, up)
 
     def process(self):
-        """Process all tasks in queue."""
-        self._processing = True
-        task = self.dequeue()
-        if not task:
-            self._processing = False
+        """Process all tasks in queue.
+
+        The tasks that complete synchronously are processed in a loop rather than through
+        recursive calls. The loop stops when a task completes asynchronously: its callback
+        calls this method again.
+
+        """
+        if self._draining:
+            # Called while a task is being evaluated in the loop below.
+            self._resume = True
             return
-        # Process the first task in queue, or stop if the queue is empty.
-        self._eval(task)
+        self._draining = True
+        try:
+            while True:
+                self._processing = True
+                self._resume = False
+                task = self.dequeue()
+                if not task:
+                    self._processing = False
+                    return
+                self._eval(task)
+                if not self._resume:
+                    return
+        finally:
+            self._draining = False
 
     def enqueue_after(self, task, output):
         """Enqueue tasks after a given action."""
@@ -153,7 +245,7 @@ class TaskLogger(object):
     def _get_clusters(self, which):
         cluster_ids, next_cluster, similar, next_similar = self.last_state()
         if which == 'all':
-            return _uniq(cluster_ids + similar)
+            return _uniq(chain(cluster_ids or (), similar or ()))
         elif which == 'best':
             return cluster_ids
         elif which == 'similar':
@@ -180,17 +272,22 @@ class TaskLogger(object):
 
     def _after_undo(self, task, output):
         """Task that should follow an undo."""
-        last_action = self.last_task(name_not_in=('select', 'next', 'previous', 'undo', 'redo'))
-        self._select_state(self.last_state(last_action))
+        state = self.last_state()
+        # Select the last state before the last action.
+        self._redo_stack.append(state)
+        self._select_state(self._undo_stack.pop() if self._undo_stack else state)
 
     def _after_redo(self, task, output):
         """Task that should follow an redo."""
-        last_undo = self.last_task('undo')
+        state = self.last_state()
         # Select the last state before the last undo.
-        self._select_state(self.last_state(last_undo))
+        self._undo_stack.append(state)
+        self._select_state(self._redo_stack.pop() if self._redo_stack else state)
 
     def _select_state(self, state):
         """Enqueue select actions when a state (selected clusters and similar clusters) is set."""
+        if state is None:
+            return
         cluster_ids, next_cluster, similar, next_similar = state
         self.enqueue(
             self.cluster_view, 'select', cluster_ids, update_views=False if similar else True)
@@ -202,13 +299,38 @@ class TaskLogger(object):
         sender, name, args, kwargs = task
         assert sender
         assert name
-        logger.log(
-            5, "Log %s %s %s %s (%s)", sender.__class__.__name__, name, args, kwargs, output)
+        if logger.isEnabledFor(5):
+            logger.log(
+                5, "Log %s %s %s %s (%s)", sender.__class__.__name__, name, args, kwargs, output)
         args = [a.tolist() if isinstance(a, np.ndarray) else a for a in args]
-        task = (sender, name, args, kwargs, output)
-        # Avoid successive duplicates (even if sender is different).
-        if not self._history or self._history[-1][1:] != task[1:]:
+        # Each history entry also holds the state just before that task.
+        state = self.last_state()
+        task = (sender, name, args, kwargs, output, state)
+        # Keep track of the state before each clustering action, to restore it after an undo.
+        if name in ('merge', 'split', 'move', 'label'):
+            self._undo_stack.append(state)
+            self._redo_stack.clear()
+        # Avoid successive duplicates (even if sender is different). The name and the
+        # number of arguments are compared first, before the arguments and the output.
+        key = (name, len(args), tuple(kwargs))
+        if key != self._last_key or not _equal(self._history[-1][2:5], (args, kwargs, output)):
+            self._last_key = key
             self._history.append(task)
+            self._update_state(sender, name, output)
+
+    def _update_state(self, sender, name, output):
+        """Keep track of the last selection in the cluster and similarity views."""
+        if name not in ('select', 'next', 'previous'):
+            return
+        if sender == self.cluster_view:
+            self._last_cluster_select = (
+                (output['selected'], output['next']) if output else (None, None))
+            # The similarity view selection is only relevant after the last cluster selection.
+            self._last_similarity_select = (None, None)
+            self.state_version += 1
+        elif sender == self.similarity_view and output:
+            self._last_similarity_select = (output['selected'], output['next'])
+            self.state_version += 1
 
     def log(self, sender, name, *args, output=None, **kwargs):
         """Add a completed task to the history stack."""
@@ -216,35 +338,25 @@ class TaskLogger(object):
 
     def last_task(self, name=None, name_not_in=()):
         """Return the last executed task."""
-        for (sender, name_, args, kwargs, output) in reversed(self._history):
+        for task in reversed(self._history):
+            name_ = task[1]
             if (name and name_ == name) or (name_not_in and name_ and name_ not in name_not_in):
                 assert name_
-                return (sender, name_, args, kwargs, output)
+                return task
 
     def last_state(self, task=None):
-        """Return (cluster_ids, next_cluster, similar, next_similar)."""
-        cluster_state = (None, None)
-        similarity_state = (None, None)
-        h = self._history
-        # Last state until the passed task, if applicable.
+        """Return (cluster_ids, next_cluster, similar, next_similar), either the current state
+        or the state just before a given task in the history."""
         if task:
-            i = self._history.index(task)
-            h = self._history[:i]
-        for (sender, name, args, kwargs, output) in reversed(h):
-            # Last selection is cluster view selection: return the state.
-            if (sender == self.similarity_view and similarity_state == (None, None) and
-                    name in ('select', 'next', 'previous')):
-                similarity_state = (output['selected'], output['next']) if output else (None, None)
-            if (sender == self.cluster_view and
-                    cluster_state == (None, None) and
-                    name in ('select', 'next', 'previous')):
-                cluster_state = (output['selected'], output['next']) if output else (None, None)
-                return (*cluster_state, *similarity_state)
+            return task[5]
+        if self._last_cluster_select is None:
+            return
+        return (*self._last_cluster_select, *self._last_similarity_select)
 
     def show_history(self):
         """Show the history stack."""
         print("=== History ===")
-        for sender, name, args, kwargs, output in self._history:
+        for sender, name, args, kwargs, output, state in self._history:
             print(
                 '{: <24} {: <8}'.format(sender.__class__.__name__, name), *args, output, kwargs)
 
@@ -297,29 +409,127 @@ class ClusterView(Table):
         # NOTE: debounce select events.
         HTMLWidget.__init__(
             self, *args, title=self.__class__.__name__, debounce_events=('select',))
+        # Last known sort and selection, so that the state does not require to query
+        # the Javascript table. They are set when the table is created.
+        self._current_sort = None
+        self._selected = None
+        # Incremented by sort_by(), to discard the outdated replies of get_current_sort().
+        self._sort_version = 0
+        # Cache of the list of shown ids, invalidated whenever the table changes.
+        self._ids = None
+        self._ids_version = 0
+        # Whether a filter may be active. The Javascript table does not raise an event when
+        # a filter fails and all rows are shown again, so the ids are not cached in this case.
+        self._filtered = False
+        connect(self._on_select, event='select', sender=self)
+        connect(self._on_table_sort, event='table_sort', sender=self)
+        connect(self._on_table_filter, event='table_filter', sender=self)
         self._set_styles()
         self._reset_table(data=data, columns=columns, sort=sort)
 
     def _reset_table(self, data=None, columns=(), sort=None):
         """Recreate the table with specified columns, data, and sort."""
         emit(self._view_name + '_init', self)
-        # Ensure 'id' is the first column.
-        if 'id' in columns:
-            columns.remove('id')
-        columns = ['id'] + list(columns)
-        # Add required columns if needed.
-        for col in self._required_columns:
-            if col not in columns:
-                columns += [col]
-            assert col in columns
-        assert columns[0] == 'id'
+        self._invalidate_ids()
+        self._filtered = False
+        # Ensure 'id' is the first column, and add required columns if needed.
+        columns = list(dict.fromkeys(chain(('id',), columns, self._required_columns)))
 
         # Allow to have <tr data_group="good"> etc. which allows for CSS styling.
         value_names = columns + [{'data': ['group']}]
         # Default sort.
         sort = sort or ('n_spikes', 'desc')
+        self._current_sort = tuple(sort)
+        self._selected = []
         self._init_table(columns=columns, value_names=value_names, data=data, sort=sort)
 
+    def _on_select(self, sender, obj, **kwargs):
+        """Keep track of the selection, whether it comes from Python or from the user."""
+        self._selected = (obj or {}).get('selected', [])
+
+    def _on_table_sort(self, sender, ids):
+        """Keep track of the current sort and of the shown ids when the table is sorted."""
+        self._invalidate_ids()
+        if ids is not None and not self._filtered:
+            self._ids = list(ids)
+        version = self._sort_version
+
+        def _on_sort(sort):
+            # Discard the reply if sort_by() has been called in the meantime.
+            if version == self._sort_version:
+                self._current_sort = tuple(sort or (None, None))
+
+        self.get_current_sort(callback=_on_sort)
+
+    def _on_table_filter(self, sender, ids):
+        """Stop caching the shown ids when the user filters the table."""
+        self._filtered = True
+        self._invalidate_ids()
+
+    def _invalidate_ids(self):
+        """Discard the cached list of shown ids, as the table has changed."""
+        self._ids = None
+        self._ids_version += 1
+
+    def get_ids(self, callback=None):
+        """Get the list of shown ids, only queried from the Javascript table after a change
+        of the table."""
+        callback = callback or (lambda _: _)
+        if self._ids is not None and not self._filtered:
+            return callback(list(self._ids))
+        version = self._ids_version
+
+        def _on_ids(ids):
+            # Discard the result if the table has changed in the meantime.
+            if version == self._ids_version and ids is not None and not self._filtered:
+                self._ids = list(ids)
+            return callback(ids)
+
+        super(ClusterView, self).get_ids(callback=_on_ids)
+
+    def filter(self, text=''):
+        """Filter the view with a Javascript expression."""
+        super(ClusterView, self).filter(text)
+        self._filtered = bool(text)
+        self._invalidate_ids()
+
+    def sort_by(self, name, sort_dir='asc'):
+        """Sort by a given variable."""
+        super(ClusterView, self).sort_by(name, sort_dir)
+        self._invalidate_ids()
+        self._sort_version += 1
+        self._current_sort = (name, sort_dir)
+
+    def select(self, ids, callback=None, **kwargs):
+        """Select some rows in the table from Python."""
+        super(ClusterView, self).select(ids, callback=callback, **kwargs)
+        self._selected = _uniq(ids)
+
+    @property
+    def selected(self):
+        """Last known list of selected ids."""
+        return self._selected
+
+    def batch_update(self, added=(), removed=(), changed=()):
+        """Add, remove, and change rows with a single Javascript call."""
+        super(ClusterView, self).batch_update(added=added, removed=removed, changed=changed)
+        if added or removed or changed:
+            self._invalidate_ids()
+
+    def remove_all(self):
+        """Remove all rows in the table."""
+        super(ClusterView, self).remove_all()
+        self._invalidate_ids()
+        # NOTE: the Javascript table clears the selection without raising a select event.
+        self._selected = []
+
+    def remove_all_and_add(self, objects):
+        """Remove all rows in the table and add new objects."""
+        super(ClusterView, self).remove_all_and_add(objects)
+        self._invalidate_ids()
+        # NOTE: the Javascript table clears the selection without raising a select event.
+        self._selected = []
+
     def _set_styles(self):
         self.builder.add_style(self._styles)
 
@@ -327,17 +537,9 @@ class ClusterView(Table):
     def state(self):
         """Return the cluster view state, with the current sort and selection."""
 
-        b = Barrier()
-        self.get_current_sort(b('current_sort'))
-        self.get_selected(b('selected'))
-        b.wait()
-
-        current_sort = tuple(b.result('current_sort')[0][0] or (None, None))
-        selected = b.result('selected')[0][0]
-
         return {
-            'current_sort': current_sort,
-            'selected': selected,
+            'current_sort': self._current_sort,
+            'selected': self._selected,
         }
 
     def set_state(self, state):
@@ -452,10 +654,9 @@ class ActionCreator(object):
         method_name = kwargs.pop('method_name', name)
         method_args = kwargs.pop('method_args', ())
         emit_fun = partial(emit, 'action', self, method_name, *method_args)
-        f = getattr(self.supervisor, method_name, None)
-        docstring = inspect.getdoc(f) if f else name
         if not kwargs.get('docstring', None):
-            kwargs['docstring'] = docstring
+            f = getattr(self.supervisor, method_name, None)
+            kwargs['docstring'] = inspect.getdoc(f) if f else name
         getattr(self, '%s_actions' % which).add(emit_fun, name=name, **kwargs)
 
     def attach(self, gui):
@@ -556,8 +757,12 @@ class ActionCreator(object):
 # Clustering GUI component
 # -----------------------------------------------------------------------------
 
+# Groups of the clusters that are skipped during the wizard.
+_MASKED_GROUPS = ('noise', 'mua')
+
+
 def _is_group_masked(group):
-    return group in ('noise', 'mua')
+    return group in _MASKED_GROUPS
 
 
 class Supervisor(object):
@@ -626,11 +831,9 @@ class Supervisor(object):
         # This is a dict {name: {cl: value}}
         self.cluster_labels = cluster_labels or {}
 
-        self.columns = ['id']  # n_spikes comes from cluster_metrics
-        self.columns += list(self.cluster_metrics.keys())
-        self.columns += [
-            label for label in self.cluster_labels.keys()
-            if label not in self.columns + ['group']]
+        self.columns = list(dict.fromkeys(chain(
+            ('id',), self.cluster_metrics.keys(),  # n_spikes comes from cluster_metrics
+            (label for label in self.cluster_labels.keys() if label != 'group'))))
 
         # Create Clustering and ClusterMeta.
         # Load the cached spikes_per_cluster array.
@@ -638,8 +841,22 @@ class Supervisor(object):
         self.clustering = Clustering(
             spike_clusters, spikes_per_cluster=spc, new_cluster_id=new_cluster_id)
 
-        # Cache the spikes_per_cluster array.
+        # Cache the spikes_per_cluster array, in a background thread.
+        self._save_pool = QThreadPool()
+        self._save_pool.setMaxThreadCount(1)
+        # Incremented at every clustering change, used to invalidate the labels cache.
+        self._cluster_ids_version = 0
+        # Cache of get_labels(), as a dict {field: (meta_version, cluster_ids_version, labels)}.
+        self._labels_cache = {}
+        # Cache of the fields property, as a tuple (cluster_meta.fields, fields).
+        self._fields_cache = None
+        # Whether spikes_per_cluster changed since it was last cached.
+        self._spc_dirty = True
         self._save_spikes_per_cluster()
+        # Cache the number of spikes per cluster, updated after every clustering change.
+        self._n_spikes_cache = {
+            cluster_id: len(spikes)
+            for cluster_id, spikes in self.clustering.spikes_per_cluster.items()}
 
         # Create the ClusterMeta instance.
         self.cluster_meta = create_cluster_meta(cluster_groups or {})
@@ -665,6 +882,14 @@ class Supervisor(object):
         # Raise supervisor.cluster
         @connect(sender=self.clustering)
         def on_cluster(sender, up):
+            self._spc_dirty = True
+            self._cluster_ids_version += 1
+            # Update the number of spikes of the deleted and new clusters.
+            spc = self.clustering.spikes_per_cluster
+            for cluster_id in up.deleted:
+                self._n_spikes_cache.pop(cluster_id, None)
+            for cluster_id in up.added:
+                self._n_spikes_cache[cluster_id] = len(spc[cluster_id])
             # NOTE: update the cluster meta of new clusters, depending on the values of the
             # ancestor clusters. In case of a conflict between the values of the old clusters,
             # the largest cluster wins and its value is set to its descendants.
@@ -677,18 +902,45 @@ class Supervisor(object):
         def on_cluster(sender, up):  # noqa
             emit('cluster', self, up)
 
+        self._new_cluster_id_dirty = False
         connect(self._save_new_cluster_id, event='cluster', sender=self)
 
+        # Selection cached for a given task logger state, selection sent in the last select
+        # event, and cluster ids of the last similarity view reset.
+        self._selection_cache = None
+        self._last_emitted_selection = None
+        self._last_similarity_reset = None
+
+        # Default callback of the wizard actions, created once.
+        self._emit_wizard_done = partial(emit, 'wizard_done', self)
+
         self._is_busy = False
+        # Local event loops waiting for the GUI to be no longer busy.
+        self._busy_loops = []
+        # Metadata changes that have yet to be sent to the cluster and similarity views,
+        # as a dict {cluster_id: row}.
+        self._pending_meta_changes = {}
 
     # Internal methods
     # -------------------------------------------------------------------------
 
     def _save_spikes_per_cluster(self):
-        """Cache on the disk the dictionary with the spikes belonging to each cluster."""
-        if not self.context:
+        """Cache on the disk the dictionary with the spikes belonging to each cluster.
+
+        The file is written in a background thread, from a shallow copy of the dictionary as
+        the clustering modifies it in place. Nothing is written if the clustering has not
+        changed since the last write.
+
+        """
+        if not self.context or not self._spc_dirty:
             return
-        self.context.save('spikes_per_cluster', self.clustering.spikes_per_cluster, kind='pickle')
+        self._spc_dirty = False
+        spc = dict(self.clustering.spikes_per_cluster)
+        self._save_pool.start(Worker(self.context.save, 'spikes_per_cluster', spc, kind='pickle'))
+
+    def _wait_save(self):
+        """Wait until the spikes_per_cluster cache has been written to disk."""
+        self._save_pool.waitForDone()
 
     def _log_action(self, sender, up):
         """Log the clustering action (merge, split)."""
@@ -717,12 +969,23 @@ class Supervisor(object):
             return
 
     def _save_new_cluster_id(self, sender, up):
+        """Schedule the saving of the new cluster id after a clustering change. Several
+        changes in the same event loop iteration lead to a single write."""
+        # Metadata changes do not change the new cluster id.
+        if not self.context or not up.added or self._new_cluster_id_dirty:
+            return
+        self._new_cluster_id_dirty = True
+        QTimer.singleShot(0, self._flush_new_cluster_id)
+
+    def _flush_new_cluster_id(self):
         """Save the new cluster id on disk, knowing that cluster ids are unique for
         easier cache consistency."""
+        if not self._new_cluster_id_dirty:
+            return
+        self._new_cluster_id_dirty = False
         new_cluster_id = self.clustering.new_cluster_id()
-        if self.context:
-            logger.log(5, "Save the new cluster id: %d.", new_cluster_id)
-            self.context.save('new_cluster_id', dict(new_cluster_id=new_cluster_id))
+        logger.log(5, "Save the new cluster id: %d.", new_cluster_id)
+        self.context.save('new_cluster_id', dict(new_cluster_id=new_cluster_id))
 
     def _save_gui_state(self, gui):
         """Save the GUI state with the cluster view and similarity view."""
@@ -733,9 +996,21 @@ class Supervisor(object):
         sim = self.similarity(cluster_id) or []
         # Only keep existing clusters.
         clusters_set = set(self.clustering.cluster_ids)
-        data = [
-            dict(similarity='%.3f' % s, **self.get_cluster_info(c))
-            for c, s in sim if c in clusters_set]
+        # Look up the metrics and fields once for all similar clusters.
+        metric_items = list(self.cluster_metrics.items())
+        meta_fields = self.cluster_meta.fields
+        get = self.cluster_meta.get
+        data = []
+        for c, s in sim:
+            if c not in clusters_set:
+                continue
+            row = {'similarity': '%.3f' % s, 'id': c}
+            for key, func in metric_items:
+                row[key] = func(c)
+            for key in meta_fields:
+                row[key] = get(key, c)
+            row['is_masked'] = _is_group_masked(row.get('group', None))
+            data.append(row)
         return data
 
     def get_cluster_info(self, cluster_id, exclude=()):
@@ -776,28 +1051,37 @@ class Supervisor(object):
     def _reset_cluster_view(self):
         """Recreate the cluster view."""
         logger.debug("Reset the cluster view.")
+        # The table is recreated without selection, so the next selection resets the
+        # similarity view and emits the select event.
+        self._last_similarity_reset = None
         self.cluster_view._reset_table(
             data=self.cluster_info, columns=self.columns, sort=self._sort)
 
-    def _clusters_added(self, cluster_ids):
-        """Update the cluster and similarity views when new clusters are created."""
-        logger.log(5, "Clusters added: %s", cluster_ids)
-        data = [self.get_cluster_info(cluster_id) for cluster_id in cluster_ids]
-        self.cluster_view.add(data)
-        self.similarity_view.add(data)
-
-    def _clusters_removed(self, cluster_ids):
-        """Update the cluster and similarity views when clusters are removed."""
-        logger.log(5, "Clusters removed: %s", cluster_ids)
-        self.cluster_view.remove(cluster_ids)
-        self.similarity_view.remove(cluster_ids)
-
     def _cluster_metadata_changed(self, field, cluster_ids, value):
         """Update the cluster and similarity views when clusters metadata is updated."""
         logger.log(5, "%s changed for %s to %s", field, cluster_ids, value)
-        data = [{'id': cluster_id, field: value} for cluster_id in cluster_ids]
-        for _ in data:
-            _['is_masked'] = _is_group_masked(_.get('group', None))
+        if not cluster_ids:
+            return
+        # All changed clusters share the same value, so the mask is only computed once.
+        is_masked = _is_group_masked(value) if field == 'group' else False
+        # Coalesce successive changes of the same clusters, they are sent to the views at once.
+        if not self._pending_meta_changes:
+            QTimer.singleShot(0, self._flush_metadata_changes)
+        for cluster_id in cluster_ids:
+            self._pending_meta_changes.setdefault(cluster_id, {}).update(
+                {'id': cluster_id, field: value, 'is_masked': is_masked})
+
+    def _pop_metadata_changes(self):
+        """Return and clear the list of pending metadata changes."""
+        data = list(self._pending_meta_changes.values())
+        self._pending_meta_changes = {}
+        return data
+
+    def _flush_metadata_changes(self):
+        """Send the pending metadata changes to the cluster and similarity views."""
+        if not self._pending_meta_changes:
+            return
+        data = self._pop_metadata_changes()
         self.cluster_view.change(data)
         self.similarity_view.change(data)
 
@@ -810,16 +1094,24 @@ class Supervisor(object):
         cluster_ids = obj['selected']
         next_cluster = obj['next']
         kwargs = obj.get('kwargs', {})
-        logger.debug("Clusters selected: %s (%s)", cluster_ids, next_cluster)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Clusters selected: %s (%s)", cluster_ids, next_cluster)
         self.task_logger.log(self.cluster_view, 'select', cluster_ids, output=obj)
-        # Update the similarity view when the cluster view selection changes.
-        self.similarity_view.reset(cluster_ids)
+        # Update the similarity view when the cluster view selection changes. The view is kept
+        # as is if the same clusters are selected again, with no similar clusters selected,
+        # and no action happened since the last reset.
+        key = tuple(cluster_ids)
+        reset = key != self._last_similarity_reset or bool(self.similarity_view.selected)
+        if reset:
+            self._last_similarity_reset = key
+            self.similarity_view.reset(cluster_ids)
         self.similarity_view.set_selected_index_offset(len(self.selected_clusters))
         # Emit supervisor.select event unless update_views is False. This happens after
         # a merge event, where the views should not be updated after the first cluster_view.select
         # event, but instead after the second similarity_view.select event.
+        # The event is always emitted when the similarity view has been reset.
         if kwargs.pop('update_views', True):
-            emit('select', self, self.selected, **kwargs)
+            self._emit_select(force=reset, **kwargs)
         if cluster_ids:
             self.cluster_view.scroll_to(cluster_ids[-1])
         self.cluster_view.dock.set_status('clusters: %s' % ', '.join(map(str, cluster_ids)))
@@ -832,24 +1124,34 @@ class Supervisor(object):
         similar = obj['selected']
         next_similar = obj['next']
         kwargs = obj.get('kwargs', {})
-        logger.debug("Similar clusters selected: %s (%s)", similar, next_similar)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Similar clusters selected: %s (%s)", similar, next_similar)
         self.task_logger.log(self.similarity_view, 'select', similar, output=obj)
-        emit('select', self, self.selected, **kwargs)
+        self._emit_select(**kwargs)
         if similar:
             self.similarity_view.scroll_to(similar[-1])
         self.similarity_view.dock.set_status('similar clusters: %s' % ', '.join(map(str, similar)))
 
+    def _emit_select(self, force=False, **kwargs):
+        """Emit the supervisor.select event, unless the selection is the same as in the last
+        event and no clustering action happened since, or unless force is True."""
+        selected = tuple(self.selected)
+        if not force and selected == self._last_emitted_selection:
+            logger.log(5, "Selection unchanged, skip the select event.")
+            return
+        self._last_emitted_selection = selected
+        emit('select', self, self.selected, **kwargs)
+
     def _on_action(self, sender, name, *args):
         """Called when an action is triggered: enqueue and process the task."""
         assert sender == self.action_creator
         # The GUI should not be busy when calling a new action.
         if 'select' not in name and self._is_busy:
             logger.log(5, "The GUI is busy, waiting before calling the action.")
-            try:
-                _block(lambda: not self._is_busy)
-            except Exception:
+            if not self._wait_not_busy():
                 logger.warning("The GUI is busy, could not execute `%s`.", name)
                 return
+        self._flush_metadata_changes()
         # Enqueue the requested action.
         self.task_logger.enqueue(self, name, *args)
         # Perform the action (which calls self.<name>(...)).
@@ -859,22 +1161,62 @@ class Supervisor(object):
         """Called after an action: update the cluster and similarity views and update
         the selection."""
         # This is called once the action has completed. We update the tables.
-        # Update the views with the old and new clusters.
-        self._clusters_added(up.added)
-        self._clusters_removed(up.deleted)
+        self._last_emitted_selection = None
+        self._last_similarity_reset = None
+        logger.log(5, "Clusters added: %s, removed: %s", up.added, up.deleted)
+        for cluster_id in up.deleted:
+            self._pending_meta_changes.pop(cluster_id, None)
         self._cluster_metadata_changed(
             up.description.replace('metadata_', ''), up.metadata_changed, up.metadata_value)
+        # The tables need to be up-to-date before the wizard selects the next clusters, so
+        # the pending metadata changes are sent together with the old and new clusters.
+        changed = self._pop_metadata_changes() if not self.task_logger.has_finished() else ()
+        added = [self.get_cluster_info(cluster_id) for cluster_id in up.added]
+        # Update the views with a single Javascript call per view.
+        for view in (self.cluster_view, self.similarity_view):
+            view.batch_update(added=added, removed=up.deleted, changed=changed)
         # After the action has finished, we process the pending actions,
         # like selection of new clusters in the tables.
         self.task_logger.process()
 
+    def _wait_not_busy(self, timeout=None):
+        """Run a local event loop until the GUI is no longer busy, or until the timeout
+        (in seconds) expires. Return whether the GUI is no longer busy."""
+        if not self._is_busy:
+            return True
+        t0 = default_timer()
+        timeout = timeout or _DEFAULT_TIMEOUT
+        loop = QEventLoop()
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(loop.quit)
+        self._busy_loops.append(loop)
+        try:
+            # The loop is also quit when the GUI is no longer busy for a nested wait, so we
+            # check again that the GUI is not busy.
+            while self._is_busy and default_timer() - t0 < timeout:
+                timer.start(max(1, int(1000 * (timeout - (default_timer() - t0)))))
+                loop.exec_()
+        finally:
+            timer.stop()
+            self._busy_loops.remove(loop)
+        if self._is_busy:
+            logger.error("Timeout while waiting for the GUI to be no longer busy.")
+            # NOTE: make sure we remove any busy cursor.
+            app = QApplication.instance()
+            app.restoreOverrideCursor()
+            app.restoreOverrideCursor()
+            return False
+        return True
+
     def _set_busy(self, busy):
         # If busy is the same, do nothing.
         if busy is self._is_busy:
             return
         self._is_busy = busy
         # Set the busy cursor.
-        logger.log(5, "GUI is %sbusy" % ('' if busy else 'not '))
+        if logger.isEnabledFor(5):
+            logger.log(5, "GUI is %sbusy", '' if busy else 'not ')
         set_busy(busy)
         # Let the cluster views know that the GUI is busy.
         self.cluster_view.set_busy(busy)
@@ -882,6 +1224,9 @@ class Supervisor(object):
         # If the GUI is no longer busy, stop the debouncer waiting period.
         if not busy:
             self.cluster_view.debouncer.stop_waiting()
+            # Resume the actions waiting for the GUI.
+            for loop in self._busy_loops:
+                loop.quit()
 
     # Selection actions
     # -------------------------------------------------------------------------
@@ -892,7 +1237,11 @@ class Supervisor(object):
         # This makes it more convenient to select multiple clusters with
         # the snippet: `:c 1 2 3` instead of `:c 1,2,3`.
         if cluster_ids and isinstance(cluster_ids[0], (tuple, list)):
-            cluster_ids = list(cluster_ids[0]) + list(cluster_ids[1:])
+            if len(cluster_ids) == 1:
+                # The common `select([1, 2, 3])` case: no need to copy the list.
+                cluster_ids = cluster_ids[0]
+            else:
+                cluster_ids = [*cluster_ids[0], *cluster_ids[1:]]
         # Remove non-existing clusters from the selection.
         #cluster_ids = self._keep_existing_clusters(cluster_ids)
         # Update the cluster view selection.
@@ -918,11 +1267,26 @@ class Supervisor(object):
     @property
     def cluster_info(self):
         """The cluster view table as a list of per-cluster dictionaries."""
-        return [self.get_cluster_info(cluster_id) for cluster_id in self.clustering.cluster_ids]
+        ids = self.clustering.cluster_ids.tolist()
+        # Compute the table column by column rather than row by row.
+        columns = {'id': ids}
+        # Cluster metrics.
+        for key, func in self.cluster_metrics.items():
+            columns[key] = [func(c) for c in ids]
+        # Cluster meta.
+        get = self.cluster_meta.get
+        for key in self.cluster_meta.fields:
+            # includes group
+            columns[key] = [get(key, c) for c in ids]
+        groups = np.array(columns.get('group', [None] * len(ids)), dtype=object)
+        columns['is_masked'] = np.isin(groups, np.array(_MASKED_GROUPS, dtype=object)).tolist()
+        keys = list(columns.keys())
+        return [dict(zip(keys, row)) for row in zip(*columns.values())]
 
     @property
     def shown_cluster_ids(self):
         """The sorted list of cluster ids as they are currently shown in the cluster view."""
+        self._flush_metadata_changes()
         b = Barrier()
         self.cluster_view.get_ids(callback=b(1))
         b.wait()
@@ -972,17 +1336,27 @@ class Supervisor(object):
         # Set the debouncer.
         self._busy = {}
         self._is_busy = False
+        # The GUI is set as not busy only after a short delay, so that rapid busy toggles
+        # during a burst of actions do not lead to cursor and table updates.
+        self._not_busy_caller = AsyncCaller(delay=75)
         # Collect all busy events from the views, and sets the GUI as busy
         # if at least one view is busy.
 
         @connect
         def on_is_busy(sender, is_busy):
             self._busy[sender] = is_busy
-            self._set_busy(any(self._busy.values()))
+            if any(self._busy.values()):
+                self._not_busy_caller.stop()
+                self._set_busy(True)
+            else:
+                self._not_busy_caller.set(partial(self._set_busy, False))
 
         @connect(sender=gui)
         def on_close(e):
             unconnect(on_is_busy, self)
+            self._not_busy_caller.stop()
+            self._flush_new_cluster_id()
+            self._wait_save()
 
         @connect(sender=self.cluster_view)
         def on_ready(sender):
@@ -991,26 +1365,36 @@ class Supervisor(object):
             if selected:  # pragma: no cover
                 self.cluster_view.select(selected)
 
+    def _get_selection(self):
+        """Return the selected clusters in the cluster view, in the similarity view, and in
+        both, as tuples recomputed only when the task logger state has changed."""
+        version = self.task_logger.state_version
+        if self._selection_cache is None or self._selection_cache[0] != version:
+            state = self.task_logger.last_state()
+            clusters = tuple(state[0] or ()) if state else ()
+            similar = tuple(state[2] or ()) if state else ()
+            self._selection_cache = (
+                version, clusters, similar, tuple(_uniq(chain(clusters, similar))))
+        return self._selection_cache[1:]
+
     @property
     def selected_clusters(self):
         """Selected clusters in the cluster view only."""
-        state = self.task_logger.last_state()
-        return state[0] or [] if state else []
+        return list(self._get_selection()[0])
 
     @property
     def selected_similar(self):
         """Selected clusters in the similarity view only."""
-        state = self.task_logger.last_state()
-        return state[2] or [] if state else []
+        return list(self._get_selection()[1])
 
     @property
     def selected(self):
         """Selected clusters in the cluster and similarity views."""
-        return _uniq(self.selected_clusters + self.selected_similar)
+        return list(self._get_selection()[2])
 
     def n_spikes(self, cluster_id):
         """Number of spikes in a given cluster."""
-        return len(self.clustering.spikes_per_cluster.get(cluster_id, []))
+        return self._n_spikes_cache.get(cluster_id, 0)
 
     # Clustering actions
     # -------------------------------------------------------------------------
@@ -1030,9 +1414,7 @@ class Supervisor(object):
         if spike_ids is None:
             # Concatenate all spike_ids returned by views who respond to request_split.
             spike_ids = emit('request_split', self)
-            spike_ids = np.concatenate(spike_ids).astype(np.int64)
-            assert spike_ids.dtype == np.int64
-            assert spike_ids.ndim == 1
+            spike_ids = _concatenate_spike_ids(spike_ids)
         if len(spike_ids) == 0:
             logger.warning(
                 """No spikes selected, cannot split.""")
@@ -1048,12 +1430,23 @@ class Supervisor(object):
     @property
     def fields(self):
         """List of all cluster label names."""
-        return tuple(f for f in self.cluster_meta.fields if f not in ('group',))
+        # The tuple of cluster meta fields is only recreated when a field is added.
+        meta_fields = self.cluster_meta.fields
+        if self._fields_cache is None or self._fields_cache[0] is not meta_fields:
+            self._fields_cache = (
+                meta_fields, tuple(f for f in meta_fields if f not in ('group',)))
+        return self._fields_cache[1]
 
     def get_labels(self, field):
         """Return the labels of all clusters, for a given label name."""
-        return {c: self.cluster_meta.get(field, c)
-                for c in self.clustering.cluster_ids}
+        versions = (self.cluster_meta.version, self._cluster_ids_version)
+        cached = self._labels_cache.get(field)
+        if cached is None or cached[:2] != versions:
+            cached = versions + ({
+                c: self.cluster_meta.get(field, c) for c in self.clustering.cluster_ids},)
+            self._labels_cache[field] = cached
+        # Return a copy so that the cache cannot be modified by the caller.
+        return dict(cached[2])
 
     def label(self, name, value, cluster_ids=None):
         """Assign a label to some clusters."""
@@ -1069,21 +1462,24 @@ class Supervisor(object):
         if name != 'group' and name not in self.columns:
             logger.debug("Add column %s.", name)
             self.columns.append(name)
+            # Send the pending metadata changes before the table is recreated.
+            self._flush_metadata_changes()
             self._reset_cluster_view()
 
     def move(self, group, which):
         """Assign a cluster group to some clusters."""
-        if which == 'all':
-            which = self.selected
-        elif which == 'best':
-            which = self.selected_clusters
-        elif which == 'similar':
-            which = self.selected_similar
-        if isinstance(which, int):
+        if isinstance(which, str):
+            if which == 'all':
+                which = self.selected
+            elif which == 'best':
+                which = self.selected_clusters
+            elif which == 'similar':
+                which = self.selected_similar
+        if isinstance(which, (int, np.integer)):
             which = [which]
-        if not which:
+        if which is None or not len(which):
             return
-        _ensure_all_ints(which)
+        which = _ensure_all_ints(which)
         logger.debug("Move %s to %s.", which, group)
         group = 'unsorted' if group is None else group
         self.label('group', group, cluster_ids=which)
@@ -1096,27 +1492,27 @@ class Supervisor(object):
 
     def reset_wizard(self, callback=None):
         """Reset the wizard."""
-        self.cluster_view.first(callback=callback or partial(emit, 'wizard_done', self))
+        self.cluster_view.first(callback=callback or self._emit_wizard_done)
 
     def next_best(self, callback=None):
         """Select the next best cluster in the cluster view."""
-        self.cluster_view.next(callback=callback or partial(emit, 'wizard_done', self))
+        self.cluster_view.next(callback=callback or self._emit_wizard_done)
 
     def previous_best(self, callback=None):
         """Select the previous best cluster in the cluster view."""
-        self.cluster_view.previous(callback=callback or partial(emit, 'wizard_done', self))
+        self.cluster_view.previous(callback=callback or self._emit_wizard_done)
 
     def next(self, callback=None):
         """Select the next cluster in the similarity view."""
         state = self.task_logger.last_state()
         if not state or not state[0]:
-            self.cluster_view.first(callback=callback or partial(emit, 'wizard_done', self))
+            self.cluster_view.first(callback=callback or self._emit_wizard_done)
         else:
-            self.similarity_view.next(callback=callback or partial(emit, 'wizard_done', self))
+            self.similarity_view.next(callback=callback or self._emit_wizard_done)
 
     def previous(self, callback=None):
         """Select the previous cluster in the similarity view."""
-        self.similarity_view.previous(callback=callback or partial(emit, 'wizard_done', self))
+        self.similarity_view.previous(callback=callback or self._emit_wizard_done)
 
     def unselect_similar(self, callback=None):
         """Select only the clusters in the cluster view."""
@@ -1153,16 +1549,20 @@ class Supervisor(object):
 
         """
         spike_clusters = self.clustering.spike_clusters
+        cluster_groups = self.cluster_meta.to_dict('group')
         groups = {
-            c: self.cluster_meta.get('group', c) or 'unsorted'
-            for c in self.clustering.cluster_ids}
+            c: cluster_groups.get(c, None) or 'unsorted'
+            for c in self.clustering.cluster_ids.tolist()}
         # List of tuples (field_name, dictionary).
         labels = [
             (field, self.get_labels(field)) for field in self.cluster_meta.fields
             if field not in ('next_cluster')]
-        emit('save_clustering', self, spike_clusters, groups, *labels)
-        # Cache the spikes_per_cluster array.
+        # Cache the spikes_per_cluster array in the background while the clustering is saved.
         self._save_spikes_per_cluster()
+        emit('save_clustering', self, spike_clusters, groups, *labels)
+        self._flush_metadata_changes()
+        self._flush_new_cluster_id()
+        self._wait_save()
         self._is_dirty = False
 
     def block(self):
@@ -1171,6 +1571,8 @@ class Supervisor(object):
         Only used in the automated testing suite.
 
         """
+        self._flush_metadata_changes()
         _block(lambda: self.task_logger.has_finished() and not self._is_busy)
         assert not self._is_busy
+        self._wait_save()
         _wait(50)
@@ -13,11 +13,13 @@ import numpy as np
 from numpy.testing import assert_array_equal as ae
 
 from .. import supervisor as _supervisor
+from .._utils import UpdateInfo
 from ..supervisor import (
-    Supervisor, TaskLogger, ClusterView, SimilarityView, ActionCreator)
+    Supervisor, TaskLogger, ClusterView, SimilarityView, ActionCreator, _concatenate_spike_ids,
+    _accepts_callback)
 from phy.gui import GUI
 from phy.gui.widgets import Barrier
-from phy.gui.qt import qInstallMessageHandler
+from phy.gui.qt import qInstallMessageHandler, QTimer
 from phy.gui.tests.test_widgets import _assert, _wait_until_table_ready
 from phy.utils.context import Context
 from phylib.utils import connect, Bunch, emit
@@ -75,6 +77,31 @@ def supervisor(qtbot, gui, cluster_ids, cluster_groups, cluster_labels,
 # Test tasks
 #------------------------------------------------------------------------------
 
+def test_accepts_callback():
+    class A(object):
+        def f(self, callback=None):
+            pass
+
+        def g(self):
+            pass
+
+    class B(object):
+        def __init__(self):
+            self.a = A()
+            self.g = lambda callback=None: None
+
+        def __getattr__(self, name):
+            return getattr(self.a, name)
+
+    assert _accepts_callback(A(), 'f')
+    assert not _accepts_callback(A(), 'g')
+
+    # Instance attribute.
+    assert _accepts_callback(B(), 'g')
+    # Delegation with __getattr__().
+    assert _accepts_callback(B(), 'f')
+
+
 @fixture
 def tl():
     class MockClusterView(object):
@@ -114,6 +141,13 @@ def tl():
     return out
 
 
+def test_concatenate_spike_ids():
+    out = _concatenate_spike_ids([np.array([3, 1], dtype=np.int32), None, [], np.array([7])])
+    assert out.dtype == np.int64
+    ae(out, [3, 1, 7])
+    assert len(_concatenate_spike_ids([])) == 0
+
+
 def test_task_1(tl):
     assert tl.last_state(None) is None
 
@@ -131,6 +165,15 @@ def test_task_3(tl):
     assert tl.last_state() == ([0], 1, [100], 101)
 
 
+def test_task_many(tl):
+    # Tasks completing synchronously are processed in a loop, without recursion.
+    for i in range(5000):
+        tl.enqueue(tl.cluster_view, 'select', [i])
+    tl.process()
+    assert tl.has_finished()
+    assert tl.last_state() == ([4999], 5000, None, None)
+
+
 def test_task_merge(tl):
     tl.enqueue(tl.cluster_view, 'select', [0])
     tl.enqueue(tl.similarity_view, 'select', [100])
@@ -148,6 +191,28 @@ def test_task_merge(tl):
     assert tl.last_state() == ([1000], 1001, None, None)
 
 
+def test_task_undo_twice(tl):
+    tl.enqueue(tl.cluster_view, 'select', [0])
+    tl.enqueue(tl.similarity_view, 'select', [100])
+    tl.enqueue(tl.supervisor, 'merge', [0, 100], 1000)
+    tl.process()
+    tl.enqueue(tl.supervisor, 'split', [1000], [1001, 1002])
+    tl.process()
+    assert tl.last_state() == ([1001, 1002], 1003, None, None)
+
+    tl.enqueue(tl.supervisor, 'undo')
+    tl.process()
+    assert tl.last_state() == ([1000], 1001, None, None)
+
+    tl.enqueue(tl.supervisor, 'undo')
+    tl.process()
+    assert tl.last_state() == ([0], 1, [100], 101)
+
+    tl.enqueue(tl.supervisor, 'redo')
+    tl.process()
+    assert tl.last_state() == ([1000], 1001, None, None)
+
+
 def test_task_split(tl):
     tl.enqueue(tl.cluster_view, 'select', [0])
     tl.enqueue(tl.similarity_view, 'select', [100])
@@ -192,6 +257,33 @@ def test_task_move_all(tl):
     assert tl.last_state() == ([1], 2, [101], 102)
 
 
+def test_task_log_duplicates(tl):
+    tl.log(tl.cluster_view, 'select', [0], output={'selected': [0], 'next': 1})
+    tl.log(tl.similarity_view, 'select', [0], output={'selected': [0], 'next': 1})
+    assert len(tl._history) == 1
+
+    # Outputs with NumPy arrays cannot be compared.
+    tl.log(tl.supervisor, 'split', [0], output=np.arange(3))
+    tl.log(tl.supervisor, 'split', [0], output=np.arange(3))
+    assert len(tl._history) == 3
+
+
+def test_task_last_state(tl):
+    tl.enqueue(tl.cluster_view, 'select', [0])
+    tl.enqueue(tl.similarity_view, 'select', [100])
+    tl.enqueue(tl.supervisor, 'merge', [0, 100], 1000)
+    tl.process()
+
+    # State just before the merge.
+    merge = tl.last_task('merge')
+    assert merge[1] == 'merge'
+    assert tl.last_task(name_not_in=('select', 'next', 'previous')) == merge
+    assert tl.last_task('select')[2] == [[1000]]
+    assert tl.last_task('undo') is None
+    assert tl.last_state(merge) == ([0], 1, [100], 101)
+    assert tl.last_state() == ([1000], 1001, None, None)
+
+
 #------------------------------------------------------------------------------
 # Test cluster and similarity views
 #------------------------------------------------------------------------------
@@ -206,6 +298,194 @@ def data():
     return _data
 
 
+class MockView(object):
+    """Cluster or similarity view without a Javascript table."""
+    selected = []
+    n_resets = 0
+    dock = Bunch(set_status=lambda _: _)
+    debouncer = Bunch(stop_waiting=lambda: None)
+
+    def __init__(self):
+        self.changes = []
+
+    def reset(self, cluster_ids):
+        self.n_resets += 1
+
+    def set_selected_index_offset(self, n):
+        pass
+
+    def scroll_to(self, cluster_id):
+        pass
+
+    def set_busy(self, busy):
+        pass
+
+    def change(self, objects):
+        self.changes.append(objects)
+
+    def batch_update(self, **kwargs):
+        pass
+
+    def _reset_table(self, **kwargs):
+        pass
+
+
+def _mock_supervisor(spike_clusters, **kwargs):
+    s = Supervisor(spike_clusters, **kwargs)
+    s.cluster_view = MockView()
+    s.similarity_view = MockView()
+    s.task_logger = TaskLogger(s.cluster_view, s.similarity_view)
+    connect(s._after_action, event='cluster', sender=s)
+    return s
+
+
+def test_supervisor_similarity_reset(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2]))
+    cv, sv = s.cluster_view, s.similarity_view
+
+    def _select(cluster_ids):
+        s._clusters_selected(cv, {'selected': cluster_ids, 'next': None})
+
+    _select([1])
+    assert sv.n_resets == 1
+
+    # The same selection does not reset the similarity view.
+    _select([1])
+    assert sv.n_resets == 1
+
+    # Unless similar clusters are selected.
+    sv.selected = [2]
+    _select([1])
+    assert sv.n_resets == 2
+    sv.selected = []
+
+    # Or after an action.
+    s._after_action(s, UpdateInfo())
+    _select([1])
+    assert sv.n_resets == 3
+
+
+def test_supervisor_selected(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2]))
+    s._clusters_selected(s.cluster_view, {'selected': [1], 'next': None})
+    assert s.selected == s.selected_clusters == [1]
+
+    # The returned lists are copies.
+    s.selected.append(2)
+    s.selected_clusters.append(2)
+    assert s.selected == s.selected_clusters == [1]
+
+
+def test_supervisor_metadata_changes(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2, 3]))
+    cv = s.cluster_view
+
+    # Several changes lead to a single update of the views, with the final values.
+    s.move('noise', [1])
+    s.move('mua', [1, 2])
+    assert cv.changes == []
+    qtbot.wait(10)
+    assert cv.changes == [[
+        {'id': 1, 'group': 'mua', 'is_masked': True},
+        {'id': 2, 'group': 'mua', 'is_masked': True},
+    ]]
+    assert s.similarity_view.changes == cv.changes
+
+    # save() sends the pending changes.
+    s.move('good', [3])
+    s.save()
+    assert cv.changes[1:] == [[{'id': 3, 'group': 'good', 'is_masked': False}]]
+    qtbot.wait(10)
+    assert len(cv.changes) == 2
+
+
+def test_supervisor_new_cluster_id(qtbot, tempdir):
+    s = _mock_supervisor(np.array([0, 1, 2, 3]), context=Context(tempdir))
+    s._wait_save()
+
+    _saved = []
+    save = s.context.save
+
+    def _save(name, data, **kwargs):
+        _saved.append((name, data))
+        save(name, data, **kwargs)
+
+    s.context.save = _save
+
+    # Several merges lead to a single write of the new cluster id.
+    s.merge([0, 1])
+    s.merge([2, 3])
+    assert _saved == []
+    qtbot.wait(10)
+    assert _saved == [('new_cluster_id', {'new_cluster_id': 6})]
+
+    # save() writes the pending new cluster id.
+    s.merge([4, 5])
+    s.save()
+    assert ('new_cluster_id', {'new_cluster_id': 7}) in _saved
+    qtbot.wait(10)
+    assert [name for name, _ in _saved].count('new_cluster_id') == 2
+    assert Context(tempdir).load('new_cluster_id') == {'new_cluster_id': 7}
+
+
+def test_supervisor_get_labels(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2]), cluster_groups={0: 'good'})
+    assert s.get_labels('group') == {0: 'good', 1: None, 2: None}
+
+    # The returned dictionary is a copy of the cache.
+    s.get_labels('group')[1] = 'mua'
+    assert s.get_labels('group')[1] is None
+
+    s.label('group', 'noise', [1, 2])
+    assert s.get_labels('group') == {0: 'good', 1: 'noise', 2: 'noise'}
+
+    s.undo()
+    assert s.get_labels('group') == {0: 'good', 1: None, 2: None}
+
+    # The cluster ids change after a merge.
+    s.merge([1, 2])
+    assert s.get_labels('group') == {0: 'good', 3: None}
+
+
+def test_supervisor_emit_select(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2]))
+    _l = []
+
+    @connect(sender=s)
+    def on_select(sender, cluster_ids):
+        _l.append(cluster_ids)
+
+    def _select(cluster_ids):
+        s._clusters_selected(s.cluster_view, {'selected': cluster_ids, 'next': None})
+
+    _select([1])
+    _select([1])
+    assert _l == [[1]]
+
+    s._emit_select(force=True)
+    assert _l == [[1], [1]]
+
+    # The select event is emitted after the cluster view has been reset.
+    s._reset_cluster_view()
+    _select([1])
+    assert _l == [[1], [1], [1]]
+
+
+def test_supervisor_wait_not_busy(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2]))
+    assert s._wait_not_busy()
+
+    s._set_busy(True)
+    assert not s._wait_not_busy(timeout=.01)
+
+    # The GUI becomes busy again right after being not busy: keep waiting.
+    QTimer.singleShot(10, lambda: s._set_busy(False))
+    QTimer.singleShot(10, lambda: s._set_busy(True))
+    QTimer.singleShot(50, lambda: s._set_busy(False))
+    assert s._wait_not_busy()
+    assert not s._is_busy
+
+
 def test_cluster_view_1(qtbot, gui, data):
     cv = ClusterView(gui, data=data)
     _wait_until_table_ready(qtbot, cv)
@@ -286,8 +566,9 @@ def test_supervisor_busy(qtbot, supervisor):
     # The action fails while the supervisor is busy.
     emit('action', supervisor.action_creator, 'merge')
 
+    # The GUI is set as not busy after a short delay.
     emit('is_busy', o, False)
-    assert not supervisor._is_busy
+    qtbot.waitUntil(lambda: not supervisor._is_busy)
 
     # The action succeeds because the supervisor is no longer busy.
     emit('action', supervisor.action_creator, 'merge')
@@ -730,6 +1011,17 @@ def test_supervisor_move_5(supervisor):
     supervisor.cluster_meta.get('group', 1) == 'good'
 
 
+def test_supervisor_move_6(qtbot):
+    s = _mock_supervisor(np.array([0, 1, 2, 3]))
+
+    # NumPy arrays and integers.
+    s.move('noise', np.array([0, 1]))
+    s.move('mua', np.int64(2))
+    s.move('good', np.array([], dtype=np.int64))
+    assert s.get_labels('group') == {0: 'noise', 1: 'noise', 2: 'mua', 3: None}
+    assert all(type(c) is int for c in s.cluster_meta.to_dict('group'))
+
+
 def test_supervisor_reset(qtbot, supervisor):
 
     supervisor.select_actions.select([10, 11])
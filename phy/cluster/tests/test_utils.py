@@ -140,6 +140,31 @@ def test_metadata_history_complex():
     assert info is None
 
 
+def test_metadata_history_values():
+    """Test that undo restores the previous values of the changed clusters only."""
+
+    meta = ClusterMeta()
+    meta.add_field('group')
+
+    meta.set('group', [1], 'good')
+    # Value set outside of the undo stack, like the metadata of new clusters after a merge.
+    meta.set('group', [2], 'mua', add_to_stack=False)
+    meta.set('group', [1, 3], 'noise')
+    assert meta.group([1, 2, 3]) == ['noise', 'mua', 'noise']
+
+    meta.undo()
+    assert meta.group([1, 2, 3]) == ['good', 'mua', None]
+    assert meta.to_dict('group') == {1: 'good', 2: 'mua'}
+
+    meta.redo()
+    assert meta.group([1, 2, 3]) == ['noise', 'mua', 'noise']
+
+    # Duplicate cluster ids.
+    meta.set('group', [2, 2], 'good')
+    meta.undo()
+    assert meta.group([1, 2, 3]) == ['noise', 'mua', 'noise']
+
+
 def test_metadata_descendants():
     """Test ClusterMeta history."""
 
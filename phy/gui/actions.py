@@ -353,9 +353,8 @@ class Actions(object):
             Whether to add the action to the toolbar.
 
         """
-        param_names = sorted(inspect.signature(Actions.add).parameters)
         l = locals()
-        kwargs = {param_name: l[param_name] for param_name in param_names if param_name != 'self'}
+        kwargs = {param_name: l[param_name] for param_name in _ACTIONS_ADD_PARAMS}
         if callback is None:
             # Allow to use either add(func) or @add or @add(...).
             kwargs.pop('callback', None)
@@ -504,6 +503,12 @@ class Actions(object):
         return '<Actions {}>'.format(sorted(self._actions_dict))
 
 
+# Names of the parameters of Actions.add(), computed once for all calls.
+_ACTIONS_ADD_PARAMS = tuple(
+    param_name for param_name in sorted(inspect.signature(Actions.add).parameters)
+    if param_name != 'self')
+
+
 # -----------------------------------------------------------------------------
 # Snippets
 # -----------------------------------------------------------------------------
@@ -653,3 +653,4 @@ class AsyncCaller(object):
         if self._timer:
             self._timer.stop()
             self._timer.deleteLater()
+            self._timer = None
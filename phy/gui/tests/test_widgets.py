@@ -391,6 +391,35 @@ def test_table_add_change_remove(qtbot, table):
     _assert(partial(table.get, 100), {'id': 100, 'count': 2000})
 
 
+def test_table_batch_update(qtbot, table):
+    table.batch_update(
+        added=[{'id': 100, 'count': 1000}], removed=[0, 1], changed=[{'id': 2, 'count': 3}])
+    _assert(table.get_ids, list(range(2, 10)) + [100])
+    _assert(partial(table.get, 2), {'id': 2, 'count': 3})
+
+
+def test_table_batch_update_undefined(qtbot, table, monkeypatch):
+    # Evaluate the batch while the Javascript table is undefined: the whole batch
+    # should be skipped without raising a Javascript error.
+    out = []
+    eval_js = HTMLWidget.eval_js
+
+    def _eval_js(self, expr, callback=None):
+        expr = '''
+            var _table = table;
+            table = undefined;
+            try { %s; "ok"; } catch (e) { "error"; } finally { table = _table; }
+            ''' % expr
+        return eval_js(self, expr, callback=out.append)
+
+    monkeypatch.setattr(HTMLWidget, 'eval_js', _eval_js)
+    table.batch_update(added=[{'id': 100, 'count': 1000}], removed=[0], changed=[{'id': 2}])
+    _block(lambda: out == ['ok'])
+    monkeypatch.undo()
+
+    _assert(table.get_ids, list(range(10)))
+
+
 def test_table_change_and_sort_1(qtbot, table):
     table.change([{'id': 5, 'count': 1000}])
     _assert(table.get_ids, list(range(10)))
@@ -9,7 +9,7 @@
 
 import json
 import logging
-from functools import partial
+from functools import partial, lru_cache
 
 from qtconsole.rich_jupyter_widget import RichJupyterWidget
 from qtconsole.inprocess import QtInProcessKernelManager
@@ -160,9 +160,7 @@ _PAGE_TEMPLATE = """
 
 def _uniq(seq):
     """Return the list of unique integers in a sequence, by keeping the order."""
-    seen = set()
-    seen_add = seen.add
-    return [int(x) for x in seq if not (x in seen or seen_add(x))]
+    return [int(x) for x in dict.fromkeys(seq)]
 
 
 class Barrier(object):
@@ -344,6 +342,7 @@ def dumps(o):
     return json.dumps(_pretty_floats(o), cls=_CustomEncoder)
 
 
+@lru_cache(maxsize=None)
 def _color_styles():
     """Use colormap colors in table widget."""
     return '\n'.join(
@@ -365,6 +364,7 @@ class Table(HTMLWidget):
     """
 
     _ready = False
+    _color_styles_added = False
 
     def __init__(
             self, *args, columns=None, value_names=None, data=None, sort=None, title='',
@@ -409,7 +409,10 @@ class Table(HTMLWidget):
         b = self.builder
         b.set_body_src('index.html')
 
-        b.add_style(_color_styles())
+        # The color styles only need to be added once, not every time the table is reset.
+        if not self._color_styles_added:
+            b.add_style(_color_styles())
+            self._color_styles_added = True
 
         self.data = data
         self.columns = columns
@@ -511,23 +514,27 @@ class Table(HTMLWidget):
         """Get the object given its id."""
         self.eval_js('table.get("id", {})[0]["_values"]'.format(id), callback=callback)
 
+    def batch_update(self, added=(), removed=(), changed=()):
+        """Add objects, remove objects from their ids, and change objects, with a single
+        Javascript call."""
+        expr = ''.join(
+            'table.{}({});'.format(method, dumps(arg)) for method, arg in (
+                ('add_', added), ('remove_', removed), ('change_', changed)) if arg)
+        if expr:
+            # Braces so that the check in eval_js() applies to all statements.
+            self.eval_js('{%s}' % expr)
+
     def add(self, objects):
         """Add objects object to the table."""
-        if not objects:
-            return
-        self.eval_js('table.add_({});'.format(dumps(objects)))
+        self.batch_update(added=objects)
 
     def change(self, objects):
         """Change some objects."""
-        if not objects:
-            return
-        self.eval_js('table.change_({});'.format(dumps(objects)))
+        self.batch_update(changed=objects)
 
     def remove(self, ids):
         """Remove some objects from their ids."""
-        if not ids:
-            return
-        self.eval_js('table.remove_({});'.format(dumps(ids)))
+        self.batch_update(removed=ids)
 
     def remove_all(self):
         """Remove all rows in the table."""
@@ -186,7 +186,11 @@ class Context(object):
         if kind == 'json':
             save_json(path, data)
         else:
-            save_pickle(path, data)
+            # Write to a temporary file first, so that the file is never partially written
+            # when it is saved in a background thread.
+            tmp_path = path.with_name(path.name + '.tmp')
+            save_pickle(tmp_path, data)
+            os.replace(str(tmp_path), str(path))
 
     def load(self, name, location='local'):
         """Load a dictionary saved in the cache directory.
@@ -60,6 +60,7 @@ def test_context_load_save_pickle(tempdir, context, temp_phy_config_dir):
     arr = np.random.rand(10, 10)
     context.save('arr', arr, kind='pickle')
     ae(context.load('arr'), arr)
+    assert not list(context.cache_dir.glob('*.tmp'))
 
 
 def test_context_cache(context):